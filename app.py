@@ -3,26 +3,76 @@ from langchain_community.llms import Ollama
 from langchain.agents import AgentType, initialize_agent, Tool
 from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
+import re
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from tools import (
     search_products, estimate_shipping, check_promo, 
     compare_prices, get_return_policy
 )
 
-# Initialize session state for memory
-if 'memory' not in st.session_state:
-    st.session_state.memory = ConversationBufferMemory(
+# Number of chat messages kept for display; older ones are dropped
+CHAT_HISTORY_SIZE = 50
+
+def create_memory() -> ConversationBufferMemory:
+    """Create and return a fresh conversation memory."""
+    return ConversationBufferMemory(
         memory_key="chat_history",
         return_messages=True
     )
 
+# Initialize session state for memory
+if 'memory' not in st.session_state:
+    st.session_state.memory = create_memory()
+
 if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+    st.session_state.chat_history = deque(maxlen=CHAT_HISTORY_SIZE)
+
+# Sections that format_response looks for, matched in a single pass
+SECTION_RE = re.compile(r'price comparison|shipping|promo', re.IGNORECASE)
+
+# Seconds to wait for the agent before giving up on a query; the agent and each
+# LLM call get their own deadlines so an abandoned query still finishes eventually
+QUERY_TIMEOUT = 180
+LLM_TIMEOUT = 120
 
+def get_query_executor() -> ThreadPoolExecutor:
+    """Return this session's single-worker thread pool for agent queries."""
+    if 'query_executor' not in st.session_state:
+        st.session_state.query_executor = ThreadPoolExecutor(max_workers=1)
+    return st.session_state.query_executor
+
+def query_in_flight() -> bool:
+    """Check whether a timed-out query is still running against this session's agent."""
+    pending = st.session_state.get('pending_query')
+    return pending is not None and not pending.done()
+
+def reset_stuck_query():
+    """Abandon a timed-out query along with the executor, agent and memory it is still using."""
+    st.session_state.query_executor.shutdown(wait=False, cancel_futures=True)
+    for key in ('query_executor', 'pending_query', 'agent'):
+        del st.session_state[key]
+    # The abandoned thread keeps the old memory, so it can never touch this one
+    st.session_state.memory = create_memory()
+
+def submit_query(agent, query: str):
+    """Run process_query on the session's executor with the script's Streamlit context."""
+    ctx = get_script_run_ctx()
+    
+    def run():
+        add_script_run_ctx(ctx=ctx)
+        return process_query(agent, query)
+        
+    return get_query_executor().submit(run)
+
+@st.cache_resource
 def create_llm():
     """Create and return the language model."""
-    return Ollama(model="mistral", temperature=0.0)
+    return Ollama(model="mistral", temperature=0.0, timeout=LLM_TIMEOUT)
 
+@st.cache_resource
 def create_agent_tools():
     """Create and return the list of tools for the agent."""
     return [
@@ -53,7 +103,7 @@ def create_agent_tools():
         )
     ]
 
-def initialize_shopping_agent():
+def initialize_shopping_agent(memory: ConversationBufferMemory):
     """Initialize and return the shopping agent and its components."""
     llm = create_llm()
     agent_tools = create_agent_tools()
@@ -80,8 +130,9 @@ def initialize_shopping_agent():
         tools=agent_tools,
         llm=llm,
         agent=AgentType.OPENAI_FUNCTIONS,
-        memory=st.session_state.memory,
+        memory=memory,
         prompt=shopping_prompt, 
+        max_execution_time=QUERY_TIMEOUT,
         verbose=True
     )
     
@@ -98,17 +149,23 @@ def format_response(response: str) -> dict:
         'promo': None
     }
     
-    if "price comparison" in ai_message.lower():
+    sections = {match.group(0).lower() for match in SECTION_RE.finditer(ai_message)}
+    
+    if "price comparison" in sections:
         formatted['price_comparison'] = "Price comparison data here"
         
-    if "shipping" in ai_message.lower():
+    if "shipping" in sections:
         formatted['shipping'] = "Shipping details here"
         
-    if "promo" in ai_message.lower():
+    if "promo" in sections:
         formatted['promo'] = "Promotion details here"
         
     return formatted
 
+def error_response(message: str) -> dict:
+    """Build a response dict that only carries an error message."""
+    return {'main_response': f"Error: {message}", 'price_comparison': None, 'shipping': None, 'promo': None}
+
 def process_query(agent, query: str) -> dict:
     """Process a user query using the shopping agent."""
     try:
@@ -117,7 +174,7 @@ def process_query(agent, query: str) -> dict:
         return formatted_response
     except Exception as e:
         print(traceback.format_exc())
-        return {'main_response': f"Error: {str(e)}", 'price_comparison': None, 'shipping': None, 'promo': None}
+        return error_response(str(e))
 
 def main():
     st.set_page_config(page_title="AI Shopping Assistant", page_icon="🛍️")
@@ -133,16 +190,27 @@ def main():
     - Check return policies
     """)
     
-    # Initialize the agent
-    agent = initialize_shopping_agent()
+    # Initialize the agent once per session; the LLM and tools are shared across sessions
+    if 'agent' not in st.session_state:
+        st.session_state.agent = initialize_shopping_agent(st.session_state.memory)
+    agent = st.session_state.agent
     
     # Query input
     query = st.text_input("What would you like to shop for today?")
     
     if st.button("Search"):
-        if query:
+        if query and query_in_flight():
+            st.warning("Still working on your previous request. Try again in a moment, "
+                       "or clear the chat history to abandon it.")
+        elif query:
             with st.spinner("Searching for the best options..."):
-                response = process_query(agent, query)
+                future = submit_query(agent, query)
+                try:
+                    response = future.result(timeout=QUERY_TIMEOUT)
+                except FutureTimeoutError:
+                    # The agent keeps running and will still write to memory; block reuse until it finishes
+                    st.session_state.pending_query = future
+                    response = error_response("The assistant took too long to respond. Please try again.")
                 
                 # Add to chat history
                 st.session_state.chat_history.append({"role": "user", "content": query})
@@ -167,14 +235,18 @@ def main():
     
     # Display chat history
     st.markdown("### Chat History")
-    for message in st.session_state.chat_history:
-        role_icon = "🤔" if message["role"] == "user" else "🛍️"
-        st.write(f"{role_icon} **{message['role'].title()}:** {message['content']}")
+    st.markdown("\n\n".join(
+        f"{'🤔' if message['role'] == 'user' else '🛍️'} **{message['role'].title()}:** {message['content']}"
+        for message in st.session_state.chat_history
+    ))
     
     # Clear chat history button
     if st.button("Clear Chat History"):
-        st.session_state.chat_history = []
-        st.session_state.memory.clear()
+        st.session_state.chat_history = deque(maxlen=CHAT_HISTORY_SIZE)
+        if query_in_flight():
+            reset_stuck_query()
+        else:
+            st.session_state.memory.clear()
         st.experimental_rerun()
 
 if __name__ == "__main__":
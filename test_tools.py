@@ -0,0 +1,39 @@
+import tools
+
+AMAZON_PAGE = b'''<html><body>
+<div data-component-type="s-search-result" class="s-result-item">
+  <h2><a class="a-link-normal s-underline-text a-text-normal" href="/Item-A/dp/A">
+  <span class="a-size-base-plus a-color-base a-text-normal">Item A no price</span></a></h2>
+  <span class="a-color-secondary">Currently unavailable.</span>
+</div>
+<div data-component-type="s-search-result" class="s-result-item">
+  <h2><a class="a-link-normal s-underline-text a-text-normal" href="/Item-B/dp/B?ref=sr&amp;th=1">
+  <span class="a-size-base-plus a-color-base a-text-normal">Women&#39;s Item B</span></a></h2>
+  <span class="a-price"><span class="a-offscreen">$99.00</span><span aria-hidden="true">
+  <span class="a-price-symbol">$</span><span class="a-price-whole">99<span class="a-price-decimal">.</span></span>
+  <span class="a-price-fraction">00</span></span></span>
+</div>
+<div data-component-type="s-search-result" class="s-result-item">
+  <h2><a class="a-link-normal s-underline-text a-text-normal" href="/Item-C/dp/C">
+  <span class="a-size-base-plus a-color-base a-text-normal">Item C</span></a></h2>
+  <span class="a-price"><span class="a-price-whole">1,249<span class="a-price-decimal">.</span></span></span>
+</div>
+</body></html>'''
+
+
+def test_amazon_fast_pattern_matches_dom_walk():
+    expected = [
+        ("Women's Item B", 99.0, 'https://www.amazon.com/Item-B/dp/B?ref=sr&th=1'),
+        ('Item C', 1249.0, 'https://www.amazon.com/Item-C/dp/C'),
+    ]
+    assert tools.scan_html(AMAZON_PAGE, 'amazon.com') == expected
+    assert tools.parse_dom(AMAZON_PAGE, 'amazon.com') == expected
+
+
+def test_dom_walk_keeps_spaces_between_text_nodes():
+    page = b'''<html><body><div class="search-result-product">
+    <a class="product-title-link" href="/ip/1">Levi's <b>501</b> Original Jeans</a>
+    <span class="price-main">$59.50</span></div></body></html>'''
+    assert tools.parse_dom(page, 'walmart.com') == [
+        ("Levi's 501 Original Jeans", 59.5, 'https://www.walmart.com/ip/1')
+    ]
@@ -1,14 +1,28 @@
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from functools import lru_cache
+from operator import attrgetter
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Dict, Optional
 from datetime import datetime, timedelta
-import requests
-from bs4 import BeautifulSoup
-from fake_useragent import UserAgent
+import asyncio
+import multiprocessing
+import os
+import random
+import threading
+import aiohttp
+import streamlit as st
+from selectolax.lexbor import LexborHTMLParser
 import re
-from concurrent.futures import ThreadPoolExecutor
 import json
+from html import unescape
 
-@dataclass
+try:
+    import uvloop
+except ImportError:  # uvloop is unavailable on Windows
+    uvloop = None
+
+@dataclass(slots=True)
 class Product:
     name: str
     price: float
@@ -21,19 +35,168 @@ class Product:
     shipping_time: Optional[int] = None
     return_policy: Optional[str] = None
 
+ProductFilter = Callable[[Product], bool]
+
+class IncompleteSearchError(Exception):
+    """Raised when some sites failed, carrying the per-site results (None for failures)."""
+    def __init__(self, results: List[Optional[List[tuple]]]):
+        super().__init__('Some sites could not be searched')
+        self.results = results
+
 # Global variables (former class attributes)
 WEBSITES = ['amazon.com', 'walmart.com', 'target.com', 'ebay.com', 'flipkart.com']
-PROMO_CODES = {
-    'SAVE10': 0.10,
-    'SUMMER20': 0.20,
-    'FLASH30': 0.30,
-    'FIRSTORDER': 0.15
+PROMO_CODES = (
+    ('SAVE10', 0.10),
+    ('SUMMER20', 0.20),
+    ('FLASH30', 0.30),
+    ('FIRSTORDER', 0.15)
+)
+PROMO_CODE_LENGTH = (2, 12)
+
+RETURN_POLICIES = {
+    'amazon.com': {
+        'window': '30 days',
+        'free_returns': True,
+        'conditions': 'Items must be unused and in original packaging',
+        'process': 'Initiate through your account or contact customer service'
+    },
+    'walmart.com': {
+        'window': '90 days',
+        'free_returns': True,
+        'conditions': 'Receipt required, items must be unused',
+        'process': 'Return to store or ship back with provided label'
+    }
+}
+DEFAULT_RETURN_POLICY = {
+    'window': 'Policy not found',
+    'free_returns': None,
+    'conditions': 'Please check store website',
+    'process': 'Contact store customer service'
+}
+
+# Search URL path for each site, followed by the query
+SEARCH_PATHS = {
+    'amazon.com': 's?k=',
+    'walmart.com': 'search?q=',
+    'target.com': 's?searchTerm=',
+    'ebay.com': 'sch/i.html?_nkw=',
+    'flipkart.com': 'search?q='
 }
 
-def get_user_agent():
-    """Create and return a new UserAgent instance."""
-    return UserAgent()
+# CSS selectors for the result tiles of each supported site
+SELECTORS = {
+    'amazon.com': {
+        'container': '.s-result-item',
+        'title': '.a-text-normal',
+        'price': '.a-price-whole',
+        'url': 'a.a-link-normal'
+    },
+    'walmart.com': {
+        'container': '.search-result-product',
+        'title': '.product-title-link',
+        'price': '.price-main',
+        'url': '.product-title-link'
+    }
+}
+
+# Byte patterns that pull (url, name, price) straight out of a page without a DOM.
+# Only for sites whose markup SELECTORS already hardcodes; the DOM walk is the fallback.
+# The gap before the price never crosses into the next result tile, so a tile without
+# a price is skipped rather than given its neighbour's.
+FAST_PATTERNS = {
+    'amazon.com': re.compile(
+        rb'<a class="a-link-normal[^"]*"[^>]*?href="(?P<url>[^"]+)"[^>]*>\s*'
+        rb'<span class="[^"]*a-text-normal[^"]*"[^>]*>(?P<name>[^<]+)</span>'
+        rb'(?:(?!s-result-item).){0,4000}?<span class="a-price-whole">(?P<price>[\d,]+)',
+        re.S
+    )
+}
+
+# Result tiles sit near the top of each page; only this much of it is parsed
+MAX_PAGE_BYTES = 256 * 1024
+
+# Page tails up to this size are read and discarded so the connection goes back to the pool;
+# anything longer or slower costs more than a new handshake, so the connection is closed
+MAX_DRAIN_BYTES = 128 * 1024
+DRAIN_TIMEOUT = 1.0
+
+# Retries for pooled keep-alive connections the server has already closed
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.3
 
+PRICE_RE = re.compile(r'[^\d.]')
+
+# Current desktop browser User-Agent strings, rotated per request
+USER_AGENT_POOL = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36 Edg/128.0.0.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:130.0) Gecko/20100101 Firefox/130.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:129.0) Gecko/20100101 Firefox/129.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.6 Safari/605.1.15',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14.6; rv:130.0) Gecko/20100101 Firefox/130.0',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:130.0) Gecko/20100101 Firefox/130.0',
+    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:129.0) Gecko/20100101 Firefox/129.0'
+)
+
+# Shared event loop and HTTP session, created lazily and reused across searches
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+_SESSION: Optional[aiohttp.ClientSession] = None
+_PARSE_POOL: Optional[ProcessPoolExecutor] = None
+_PARSE_POOL_LOCK = threading.Lock()
+
+# Seconds a search result stays fresh in st.cache_data
+SEARCH_CACHE_TTL = 600
+
+# Seconds to wait for the whole fan-out, parsing included, before giving up on it
+SEARCH_TIMEOUT = 30
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the background event loop that runs all site fetches."""
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name='search-loop', daemon=True).start()
+    return _LOOP
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Return the process pool that parses result pages, creating it on first use."""
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is None:
+            # Spawn rather than fork: the parent already runs the search loop and Streamlit's threads
+            _PARSE_POOL = ProcessPoolExecutor(
+                max_workers=min(len(SELECTORS), os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+    return _PARSE_POOL
+
+def reset_parse_pool(broken: ProcessPoolExecutor) -> None:
+    """Discard a broken parse pool so the next call to get_parse_pool builds a new one."""
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is broken:
+            _PARSE_POOL = None
+    broken.shutdown(wait=False)
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the shared HTTP session. Must be called on the background loop."""
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=32, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=60
+            ),
+            timeout=aiohttp.ClientTimeout(total=10)
+        )
+    return _SESSION
+
+@lru_cache(maxsize=512)
 def clean_url(url: str, site: str) -> str:
     """Clean and validate product URLs."""
     if not url:
@@ -47,109 +210,208 @@ def clean_url(url: str, site: str) -> str:
 def clean_price(price_str: str) -> float:
     """Extract and clean price from string."""
     try:
-        price_str = re.sub(r'[^\d.]', '', re.sub(r'[^\d.,]', '', price_str))
-        return float(price_str)
-    except (ValueError, TypeError):
+        return float(PRICE_RE.sub('', price_str or '') or 0)
+    except ValueError:  # e.g. more than one '.' left after stripping
         return 0.0
 
-def matches_filters(product: Product, filters: Optional[Dict] = None) -> bool:
-    """Check if product matches given filters."""
+def build_filter(filters: Optional[Dict] = None) -> Optional[ProductFilter]:
+    """Build a predicate that checks only the filters that are set, or None if none are."""
     if not filters:
-        return True
+        return None
         
-    for key, value in filters.items():
-        if key == 'max_price' and product.price > value:
-            return False
-        if key == 'min_price' and product.price < value:
-            return False
-        if key == 'size' and product.size != value:
-            return False
-        if key == 'color' and product.color != value:
-            return False
-    return True
-
-def search_site(site: str, query: str, filters: Dict = None) -> List[Product]:
-    """Search a single site for products."""
-    headers = {'User-Agent': get_user_agent().random}
-    search_query_url_tag = {
-        "amazon.com": "s?k=", 
-        "walmart.com": "search?q=", 
-        "target.com": "s?searchTerm=", 
-        "ebay.com" :"sch/i.html?_nkw=", 
-        "flipkart.com": "search?q="
-    }
-    search_url = f"https://www.{site}/{search_query_url_tag[site]}{query.replace(' ', '+')}"
+    checks = []
+    if 'max_price' in filters:
+        max_price = filters['max_price']
+        checks.append(lambda product: product.price <= max_price)
+    if 'min_price' in filters:
+        min_price = filters['min_price']
+        checks.append(lambda product: product.price >= min_price)
+    if 'size' in filters:
+        size = filters['size']
+        checks.append(lambda product: product.size == size)
+    if 'color' in filters:
+        color = filters['color']
+        checks.append(lambda product: product.color == color)
+        
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+    return lambda product: all(check(product) for check in checks)
+
+async def read_head(response: aiohttp.ClientResponse, limit: int) -> bytes:
+    """Return the first `limit` bytes of a response body, draining a short tail."""
+    chunks = []
+    remaining = limit
+    while remaining > 0:
+        chunk = await response.content.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    head = b''.join(chunks)
+    if response.content.at_eof():
+        return head
+        
+    # aiohttp won't pool a connection whose body was left unread, so drain the tail when
+    # it is short; a failure or timeout here only costs the connection, never the head
+    length = response.content_length
+    if length is None or length <= limit + MAX_DRAIN_BYTES:
+        try:
+            if await asyncio.wait_for(discard_body(response, MAX_DRAIN_BYTES), DRAIN_TIMEOUT):
+                return head
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+    response.close()
+    return head
+
+async def discard_body(response: aiohttp.ClientResponse, limit: int) -> bool:
+    """Read and discard up to `limit` more body bytes, returning whether the body ended."""
+    drained = 0
+    while drained <= limit:
+        chunk = await response.content.readany()
+        if not chunk:
+            return True
+        drained += len(chunk)
+    return False
+
+async def get_page(session: aiohttp.ClientSession, url: str, headers: Dict) -> bytes:
+    """GET the head of a page, retrying if a pooled connection was dropped."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with session.get(url, headers=headers) as response:
+                return await read_head(response, MAX_PAGE_BYTES)
+        except aiohttp.ServerDisconnectedError:
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+async def fetch_site(session: aiohttp.ClientSession, site: str, query: str) -> Optional[List[tuple]]:
+    """Fetch a single site's search page and parse it into (name, price, url) rows, or None on failure."""
+    if site not in SELECTORS:
+        return []
+        
+    headers = {'User-Agent': random.choice(USER_AGENT_POOL)}
+    search_url = f"https://www.{site}/{SEARCH_PATHS[site]}{query.replace(' ', '+')}"
+    
+    try:
+        html = await get_page(session, search_url, headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error searching {site}: {str(e)}")
+        return None
     
+    # Parsing is CPU-bound, so run it in worker processes instead of on the event loop
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
     try:
-        response = requests.get(search_url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        return await loop.run_in_executor(pool, parse_site_bytes, site, html)
+    except BrokenProcessPool as e:
+        # A dead worker breaks the whole pool; drop it so the next search builds a new one
+        reset_parse_pool(pool)
+        print(f"Error parsing {site}: {str(e)}")
+        return None
+
+def parse_site_bytes(site: str, body: bytes) -> List[tuple]:
+    """Parse a result page into (name, price, url) rows. Runs in the parse pool."""
+    return scan_html(body, site) or parse_dom(body, site)
+
+def build_products(site: str, rows: List[tuple], predicate: Optional[ProductFilter] = None) -> List[Product]:
+    """Turn parsed rows into at most five products that pass the predicate."""
+    products = [
+        Product(name=name, price=price, website=site, url=url, in_stock=True)
+        for name, price, url in rows
+    ]
+    if predicate is not None:
+        products = [product for product in products if predicate(product)]
+    return products[:5]
+
+def scan_html(html: bytes, site: str) -> List[tuple]:
+    """Extract rows from the raw page bytes with the site's fast pattern, if it has one."""
+    pattern = FAST_PATTERNS.get(site)
+    if pattern is None:
+        return []
         
-        selectors = {
-            'amazon.com': {
-                'container': 's-result-item',
-                'title': 'a-text-normal',
-                'price': 'a-price-whole',
-                'url': 'a.a-link-normal'
-            },
-            'walmart.com': {
-                'container': 'search-result-product',
-                'title': 'product-title-link',
-                'price': 'price-main',
-                'url': 'product-title-link'
-            }
-        }
+    rows = []
+    for match in pattern.finditer(html):
+        price = clean_price(match.group('price').decode('ascii'))
+        if price > 0:
+            rows.append((
+                unescape(match.group('name').decode('utf-8', 'replace')).strip(),
+                price,
+                clean_url(unescape(match.group('url').decode('utf-8', 'replace')), site)
+            ))
+    return rows
+
+def parse_dom(html: bytes, site: str) -> List[tuple]:
+    """Extract rows by walking the page DOM with the site's CSS selectors."""
+    site_selectors = SELECTORS[site]
+    tree = LexborHTMLParser(html)
+    if tree.body is None:
+        return []
         
-        site_selectors = selectors.get(site)
-        if not site_selectors:
-            return []
+    rows = []
+    for item in tree.body.css(site_selectors['container']):
+        name_elem, price_elem, url_elem = (
+            item.css_first(site_selectors['title']),
+            item.css_first(site_selectors['price']),
+            item.css_first(site_selectors['url'])
+        )
+        if name_elem is None or price_elem is None or url_elem is None:
+            continue
             
-        products = []
-        for item in soup.find_all(class_=site_selectors['container']):
-            try:
-                name_elem = item.find(class_=site_selectors['title'])
-                price_elem = item.find(class_=site_selectors['price'])
-                url_elem = item.find(site_selectors['url'])
-                
-                if name_elem and price_elem and url_elem:
-                    price_text = price_elem.text.strip()
-                    price = clean_price(price_text)
-                    
-                    if price > 0:
-                        product = Product(
-                            name=name_elem.text.strip(),
-                            price=price,
-                            website=site,
-                            url=clean_url(url_elem.get('href'), site),
-                            in_stock=True
-                        )
-                        
-                        if matches_filters(product, filters):
-                            products.append(product)
+        price = clean_price(price_elem.text().strip())
+        if price > 0:
+            rows.append((
+                name_elem.text().strip(),
+                price,
+                clean_url(url_elem.attributes.get('href'), site)
+            ))
             
-            except Exception as e:
-                continue
-                
-        return products[:5]
-        
-    except requests.RequestException as e:
-        print(f"Error searching {site}: {str(e)}")
-        return []
+    return rows
+
+async def search_all_sites(query: str) -> List[Optional[List[tuple]]]:
+    """Fetch every site concurrently over the shared session."""
+    session = get_session()
+    return await asyncio.gather(*[
+        fetch_site(session, site, query) for site in WEBSITES
+    ])
+
+def normalize_query(query: str) -> str:
+    """Lowercase a query and collapse its whitespace so equal searches share a key."""
+    return ' '.join(query.lower().split())
 
 def search_products(query: str, filters: Dict = None) -> List[Product]:
     """Search for products across multiple e-commerce sites."""
-    with ThreadPoolExecutor(max_workers=len(WEBSITES)) as executor:
-        all_results = list(executor.map(
-            lambda site: search_site(site, query, filters), 
-            WEBSITES
-        ))
-    
+    query = normalize_query(query)
+    # Only the unfiltered rows are cached, so re-filtering a query never refetches it
+    predicate = build_filter(filters)
+    try:
+        results = _fetch_rows_cached(query)
+    except IncompleteSearchError as e:
+        results = e.results
+        
     products = []
-    for result in all_results:
-        products.extend(result)
-    
-    products.sort(key=lambda x: x.price)
+    for site, rows in zip(WEBSITES, results):
+        if rows:
+            products.extend(build_products(site, rows, predicate))
+    products.sort(key=attrgetter('price'))
     return products
 
+@st.cache_data(ttl=SEARCH_CACHE_TTL, show_spinner=False)
+def _fetch_rows_cached(query: str) -> List[List[tuple]]:
+    """Run the network fan-out, reusing each site's rows for ten minutes."""
+    future = asyncio.run_coroutine_threadsafe(search_all_sites(query), get_event_loop())
+    try:
+        results = future.result(timeout=SEARCH_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        print(f"Search for '{query}' timed out after {SEARCH_TIMEOUT}s")
+        raise IncompleteSearchError([None] * len(WEBSITES))
+    if any(rows is None for rows in results):
+        # st.cache_data doesn't cache exceptions, so a failed site is retried next search
+        raise IncompleteSearchError(results)
+    return results
+
 def estimate_shipping(product: Product, zip_code: str, target_date: Optional[datetime] = None) -> Dict:
     """Estimate shipping time and cost."""
     shipping_options = {
@@ -186,17 +448,19 @@ def estimate_shipping(product: Product, zip_code: str, target_date: Optional[dat
 
 def check_promo(code: str, base_price: float) -> Dict:
     """Validate and calculate discounted price."""
-    code = code.upper()
-    if code in PROMO_CODES:
-        discount = PROMO_CODES[code]
-        final_price = base_price * (1 - discount)
-        return {
-            'valid': True,
-            'discount_percentage': discount * 100,
-            'original_price': base_price,
-            'final_price': final_price,
-            'savings': base_price - final_price
-        }
+    min_length, max_length = PROMO_CODE_LENGTH
+    if min_length <= len(code) <= max_length and code.isalnum():
+        code = code.upper()
+        for promo_code, discount in PROMO_CODES:
+            if code == promo_code:
+                final_price = base_price * (1 - discount)
+                return {
+                    'valid': True,
+                    'discount_percentage': discount * 100,
+                    'original_price': base_price,
+                    'final_price': final_price,
+                    'savings': base_price - final_price
+                }
     return {
         'valid': False,
         'message': 'Invalid promo code'
@@ -204,34 +468,17 @@ def check_promo(code: str, base_price: float) -> Dict:
 
 def compare_prices(product_name: str) -> List[Dict]:
     """Compare prices across different stores."""
+    # Shares search_products' normalized cache key, so a prior SearchProducts call is reused;
+    # search_products already returns products in price order
     products = search_products(product_name)
-    return sorted([{
+    return [{
         'store': p.website,
         'price': p.price,
         'url': p.url,
         'in_stock': p.in_stock
-    } for p in products], key=lambda x: x['price'])
+    } for p in products]
 
 def get_return_policy(website: str) -> Dict:
     """Get return policy details for a store."""
-    return_policies = {
-        'amazon.com': {
-            'window': '30 days',
-            'free_returns': True,
-            'conditions': 'Items must be unused and in original packaging',
-            'process': 'Initiate through your account or contact customer service'
-        },
-        'walmart.com': {
-            'window': '90 days',
-            'free_returns': True,
-            'conditions': 'Receipt required, items must be unused',
-            'process': 'Return to store or ship back with provided label'
-        }
-    }
-    
-    return return_policies.get(website, {
-        'window': 'Policy not found',
-        'free_returns': None,
-        'conditions': 'Please check store website',
-        'process': 'Contact store customer service'
-    })
\ No newline at end of file
+    # Copy so callers can't modify the shared table
+    return dict(RETURN_POLICIES.get(website, DEFAULT_RETURN_POLICY))
\ No newline at end of file